@@ -135,3 +135,47 @@ CSRF_TRUSTED_ORIGINS = [
     "https://pdf-img-ec7n.onrender.com",
 ]
 
+# Image encoding
+# Default speed/size preset for image outputs: 'fast', 'balanced' or 'small'.
+# Requests may override it with a `preset` form field.
+IMAGE_ENCODE_PRESET = 'balanced'
+
+# Archives
+# Multi-file outputs are built in memory up to this size, then spill to a temporary file.
+ARCHIVE_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+# Concurrency
+# Tool views run their CPU work on a shared thread pool of this size.
+TOOL_EXECUTOR_WORKERS = 4
+# Per-operation limits: `concurrency` calls run at once, up to `queue` more wait,
+# and anything beyond that gets a 503 with Retry-After (seconds).
+OPERATION_LIMITS = {
+    'default': {'concurrency': 2, 'queue': 8},
+    'pdf_to_images': {'concurrency': 1, 'queue': 4},
+    'compress_pdf': {'concurrency': 1, 'queue': 2},
+    'pdf_pipeline': {'concurrency': 1, 'queue': 2},
+}
+OPERATION_RETRY_AFTER = 10
+
+# Admission control
+# Each request's memory and CPU use is estimated from file headers before work starts.
+# Over the per-request budget it is downgraded (lower DPI) or rejected with a 413;
+# it then waits up to ADMISSION_QUEUE_TIMEOUT seconds for room in the global memory budget.
+ADMISSION_REQUEST_MEMORY = 1024 * 1024 * 1024
+ADMISSION_REQUEST_CPU_SECONDS = 60
+ADMISSION_GLOBAL_MEMORY = 2048 * 1024 * 1024
+ADMISSION_QUEUE_TIMEOUT = 30
+ADMISSION_CPU_SECONDS_PER_MEGAPIXEL = 0.02
+# Uploads whose headers cannot be read are charged this multiple of their size
+ADMISSION_UNREADABLE_INPUT_FACTOR = 20
+
+# Large images
+# crop_image and resize_pixels decode only the tiles/strips they need and never
+# hold more than IMAGE_DECODE_MEMORY_LIMIT bytes of pixels; band-by-band
+# downscaling uses bands of up to IMAGE_BAND_MEMORY bytes.
+IMAGE_DECODE_MEMORY_LIMIT = 512 * 1024 * 1024
+IMAGE_BAND_MEMORY = 64 * 1024 * 1024
+# Pillow's MAX_IMAGE_PIXELS for the process, so the tiled engine can open huge scans
+# (Pillow refuses twice this many). Views that decode whole images stay held to
+# Pillow's default cap by admission.
+IMAGE_MAX_PIXELS = 500_000_000
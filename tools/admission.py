@@ -0,0 +1,309 @@
+import base64
+import io
+import threading
+from django.conf import settings
+from PIL import Image
+import pikepdf
+from . import tiles
+from .pipeline import PipelineError, parse_operations
+
+
+MB = 1024 * 1024
+
+# Rasterizing operations are downgraded through these DPIs when over budget
+PDF_TO_IMAGES_DPIS = [200, 150, 100, 75]
+COMPRESS_PDF_DPIS = [300, 200, 150, 100, 75, 50, 40, 30]
+
+# Pillow's own MAX_IMAGE_PIXELS default. The process-wide limit is raised for the
+# tiled engine, so views that decode whole images are held to this one here.
+DEFAULT_MAX_PIXELS = 1024 * 1024 * 1024 // 4 // 3
+
+# Rendered PDF pages come back from poppler as RGB
+RASTER_PIXEL_BYTES = tiles.pixel_bytes('RGB')
+
+
+class OverBudget(Exception):
+    pass
+
+
+class Cost:
+    """Rough prediction of what an operation will use: peak memory (bytes) and CPU seconds."""
+
+    def __init__(self, memory, cpu_seconds, dpi=None):
+        self.memory = int(memory)
+        self.cpu_seconds = cpu_seconds
+        self.dpi = dpi
+
+    def __repr__(self):
+        return f'Cost(memory={self.memory / MB:.1f}MB, cpu={self.cpu_seconds:.1f}s, dpi={self.dpi})'
+
+
+def _cpu_for(megapixels):
+    return megapixels * getattr(settings, 'ADMISSION_CPU_SECONDS_PER_MEGAPIXEL', 0.02)
+
+
+def _image_headers(files):
+    # Image.open only parses the header; nothing is decoded here
+    headers = []
+    for f in files:
+        with Image.open(f) as img:
+            # Same threshold at which Pillow raises by default
+            if img.width * img.height > 2 * DEFAULT_MAX_PIXELS:
+                raise Image.DecompressionBombError(
+                    f'Image size ({img.width * img.height} pixels) exceeds limit of '
+                    f'{2 * DEFAULT_MAX_PIXELS} pixels.'
+                )
+            headers.append((img.width, img.height, tiles.pixel_bytes(img.mode)))
+        f.seek(0)
+    return headers
+
+
+def _crop_source(request):
+    if request.POST.get('image_data'):
+        img_data = request.POST['image_data']
+        if img_data.startswith('data:image'):
+            img_data = img_data.split(',')[1]
+        return io.BytesIO(base64.b64decode(img_data))
+    return request.FILES.get('image')
+
+
+def _pdf_page_sizes(files):
+    # Page count and media boxes come from the xref/page tree; no page is rendered.
+    # qpdf opens owner-password (AES) files that PyPDF2 cannot.
+    sizes = []
+    for f in files:
+        with pikepdf.open(f) as pdf:
+            for page in pdf.pages:
+                box = [float(v) for v in page.mediabox]
+                sizes.append((abs(box[2] - box[0]), abs(box[3] - box[1])))
+        f.seek(0)
+    return sizes
+
+
+def _raster_pixels(page_sizes, dpi):
+    return sum((w / 72 * dpi) * (h / 72 * dpi) for w, h in page_sizes)
+
+
+def _input_size(request):
+    # crop_image can also receive its image base64-encoded in a form field
+    size = len(request.POST.get('image_data', ''))
+    return size + sum(f.size for _, files in request.FILES.lists() for f in files)
+
+
+# ==================== ESTIMATORS ====================
+# Each returns candidate costs, best quality first.
+
+def _estimate_pdf_structure(request):
+    # merge/delete/watermark/encrypt keep parsed objects plus the output in memory
+    size = _input_size(request)
+    return [Cost(size * 4, _cpu_for(size / MB / 10))]
+
+
+def _estimate_pdf_to_images(request):
+    pages = _pdf_page_sizes([request.FILES['pdf']])
+    costs = []
+    for dpi in PDF_TO_IMAGES_DPIS:
+        pixels = _raster_pixels(pages, dpi)
+        # Every page stays decoded until the archive is written
+        costs.append(Cost(pixels * RASTER_PIXEL_BYTES + _input_size(request), _cpu_for(pixels / MB * 2), dpi=dpi))
+    return costs
+
+
+def _compress_costs(pages):
+    costs = []
+    for dpi in COMPRESS_PDF_DPIS:
+        pixels = _raster_pixels(pages, dpi)
+        # Rendered pages, their RGB copies and the re-encoded output
+        costs.append(Cost(pixels * RASTER_PIXEL_BYTES * 3, _cpu_for(pixels / MB * 3), dpi=dpi))
+    return costs
+
+
+def _estimate_compress_pdf(request):
+    return _compress_costs(_pdf_page_sizes([request.FILES['pdf']]))
+
+
+def _estimate_pdf_pipeline(request):
+    # Only a trailing compress rasterizes; every other step is structural
+    try:
+        steps = parse_operations(request.POST.get('operations'))
+    except PipelineError:
+        # The view rejects the operations before any work starts
+        return _estimate_pdf_structure(request)
+    if steps[-1]['op'] != 'compress':
+        return _estimate_pdf_structure(request)
+    return _compress_costs(_pdf_page_sizes(request.FILES.getlist('pdfs')))
+
+
+def _estimate_images_to_pdf(request):
+    headers = _image_headers(request.FILES.getlist('images'))
+    pixels = sum(w * h for w, h, _ in headers)
+    # Every decoded image and its RGB copy stay alive until the PDF is written
+    memory = sum(w * h * (per_pixel + RASTER_PIXEL_BYTES) for w, h, per_pixel in headers)
+    return [Cost(memory, _cpu_for(pixels / MB))]
+
+
+def _estimate_resize_pixels(request):
+    f = request.FILES['image']
+    size = (int(request.POST.get('width', 800)), int(request.POST.get('height', 600)))
+    with tiles.open_image(f) as img:
+        memory = tiles.resize_bytes(img, size)
+        pixels = img.width * img.height + size[0] * size[1]
+    f.seek(0)
+    # Reject here what the engine would refuse, rather than failing inside the view
+    tiles.check_memory(memory)
+    return [Cost(memory, _cpu_for(pixels / MB))]
+
+
+def _estimate_resize_filesize(request):
+    w, h, per_pixel = _image_headers([request.FILES['image']])[0]
+    # The decoded image and its converted copy; the quality search encodes several times
+    return [Cost(w * h * per_pixel * 2, _cpu_for(w * h / MB * 4))]
+
+
+def _estimate_crop_image(request):
+    box = tuple(int(float(request.POST.get(k, d))) for k, d in
+                (('left', 0), ('top', 0), ('right', 100), ('bottom', 100)))
+    f = _crop_source(request)
+    with tiles.open_image(f) as img:
+        box = tiles.clamp_box(box, img.size)
+        memory = tiles.crop_bytes(img, box)
+        pixels = memory / tiles.pixel_bytes(img.mode)
+    f.seek(0)
+    tiles.check_memory(memory)
+    return [Cost(memory, _cpu_for(pixels / MB))]
+
+
+def _estimate_compress_image(request):
+    w, h, per_pixel = _image_headers([request.FILES['image']])[0]
+    return [Cost(w * h * per_pixel * 2, _cpu_for(w * h / MB))]
+
+
+def _estimate_create_collage(request):
+    headers = _image_headers(request.FILES.getlist('images'))
+    pixels = sum(w * h for w, h, _ in headers)
+    collage_pixels = len(headers) * 220 * 220
+    memory = sum(w * h * per_pixel for w, h, per_pixel in headers) + collage_pixels * RASTER_PIXEL_BYTES
+    return [Cost(memory, _cpu_for((pixels + collage_pixels) / MB))]
+
+
+ESTIMATORS = {
+    'merge_pdf': _estimate_pdf_structure,
+    'delete_page': _estimate_pdf_structure,
+    'watermark_pdf': _estimate_pdf_structure,
+    'encrypt_pdf': _estimate_pdf_structure,
+    'pdf_to_images': _estimate_pdf_to_images,
+    'compress_pdf': _estimate_compress_pdf,
+    'pdf_pipeline': _estimate_pdf_pipeline,
+    'images_to_pdf': _estimate_images_to_pdf,
+    'resize_pixels': _estimate_resize_pixels,
+    'resize_filesize': _estimate_resize_filesize,
+    'crop_image': _estimate_crop_image,
+    'compress_image': _estimate_compress_image,
+    'create_collage': _estimate_create_collage,
+}
+
+# Operations whose output resolution can be lowered to fit the budget
+RASTER_DPIS = {
+    'pdf_to_images': PDF_TO_IMAGES_DPIS,
+    'compress_pdf': COMPRESS_PDF_DPIS,
+    'pdf_pipeline': COMPRESS_PDF_DPIS,
+}
+
+
+def _fallback_costs(operation, request):
+    # Headers could not be read, so charge a multiple of the upload size and
+    # render at the lowest resolution rather than admitting the request for free
+    size = _input_size(request)
+    factor = getattr(settings, 'ADMISSION_UNREADABLE_INPUT_FACTOR', 20)
+    dpis = RASTER_DPIS.get(operation)
+    return [Cost(size * factor, _cpu_for(size / MB * factor), dpi=dpis[-1] if dpis else None)]
+
+
+def estimate(operation, request):
+    """Return candidate costs for the request, or None for operations without an estimator.
+
+    Inputs whose headers cannot be read get a conservative size-based cost.
+    Raises OverBudget for inputs that are rejected on their headers alone.
+    """
+    estimator = ESTIMATORS.get(operation)
+    if estimator is None:
+        return None
+    try:
+        return estimator(request)
+    except OverBudget:
+        raise
+    except tiles.DecodeLimitExceeded as e:
+        raise OverBudget(str(e))
+    except Image.DecompressionBombError as e:
+        # Pillow refuses the dimensions outright; no budget could admit it
+        raise OverBudget(f'This image is too large to process: {e}')
+    except Exception:
+        # Unreadable input; the view reports the real error if it fails too
+        return _fallback_costs(operation, request)
+
+
+def choose(costs):
+    """Pick the first candidate within the per-request budget, or raise OverBudget."""
+    memory_limit = getattr(settings, 'ADMISSION_REQUEST_MEMORY', 1024 * MB)
+    cpu_limit = getattr(settings, 'ADMISSION_REQUEST_CPU_SECONDS', 60)
+    for cost in costs:
+        if cost.memory <= memory_limit and cost.cpu_seconds <= cpu_limit:
+            return cost
+    cost = costs[-1]
+    raise OverBudget(
+        f'This file is too large to process: it needs about {cost.memory / MB:.0f} MB of memory '
+        f'and {cost.cpu_seconds:.0f}s of CPU (limits: {memory_limit / MB:.0f} MB, {cpu_limit:.0f}s).'
+    )
+
+
+class MemoryBudget:
+    """Process-wide memory reservations shared by all in-flight operations.
+
+    Requests that do not fit can register a waiter future with try_reserve;
+    every release wakes the waiters through their own loop so they retry.
+    """
+
+    def __init__(self):
+        self.used = 0
+        self.waiters = []
+        self.lock = threading.Lock()
+
+    def try_reserve(self, amount, waiter=None):
+        """Reserve `amount` bytes; otherwise register `waiter` (loop, future) and return False."""
+        limit = getattr(settings, 'ADMISSION_GLOBAL_MEMORY', 2048 * MB)
+        with self.lock:
+            # A lone request is always admitted so oversized limits cannot deadlock
+            if self.used == 0 or self.used + amount <= limit:
+                self.used += amount
+                return True
+            # Registered under the lock so a concurrent release cannot be missed
+            if waiter is not None:
+                self.waiters.append(waiter)
+            return False
+
+    def discard(self, waiter):
+        with self.lock:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def release(self, amount):
+        with self.lock:
+            self.used -= amount
+            waiters, self.waiters = self.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+global_budget = MemoryBudget()
+
+
+def admitted_dpi(request, default):
+    cost = getattr(request, 'cost', None)
+    if cost is None or cost.dpi is None:
+        return default
+    return cost.dpi
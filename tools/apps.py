@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ToolsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tools'
+
+    def ready(self):
+        from PIL import Image
+
+        # Set once for the whole process: the tiled engine accepts images this large,
+        # and admission holds every other image view to Pillow's default cap.
+        Image.MAX_IMAGE_PIXELS = getattr(settings, 'IMAGE_MAX_PIXELS', Image.MAX_IMAGE_PIXELS)
@@ -0,0 +1,56 @@
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from django.conf import settings
+
+
+# Payloads that are already entropy-coded; deflating them again only burns CPU
+STORED_EXTENSIONS = {
+    'jpg', 'jpeg', 'png', 'webp', 'avif', 'gif', 'pdf', 'zip', 'gz',
+}
+
+
+def compression_for(name):
+    extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    if extension in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+class ArchiveWriter:
+    """ZIP writer for multi-file outputs.
+
+    The archive is spooled in memory and moves to a temporary file once it
+    grows past ARCHIVE_SPOOL_MAX_SIZE, so huge exports do not sit in RAM.
+    Members are written straight into the archive without intermediate copies.
+    """
+
+    def __init__(self, max_memory_size=None):
+        if max_memory_size is None:
+            max_memory_size = getattr(settings, 'ARCHIVE_SPOOL_MAX_SIZE', 64 * 1024 * 1024)
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_memory_size)
+        self.zipfile = zipfile.ZipFile(self.file, 'w', allowZip64=True)
+
+    @contextmanager
+    def open(self, name, large=False):
+        """Open a writable member; pass large=True if it may exceed 2 GiB (forces ZIP64)."""
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.external_attr = 0o600 << 16
+        info.compress_type = compression_for(name)
+        with self.zipfile.open(info, 'w', force_zip64=large) as member:
+            yield member
+
+    def close(self):
+        """Finish the archive and return the underlying file, rewound for reading."""
+        self.zipfile.close()
+        self.file.seek(0)
+        return self.file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.zipfile.close()
+            self.file.close()
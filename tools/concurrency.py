@@ -0,0 +1,156 @@
+import asyncio
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.shortcuts import render
+from . import admission
+
+
+class OperationRejected(Exception):
+    pass
+
+
+class OperationLimiter:
+    """Caps concurrently running calls of one operation and the queue behind them.
+
+    Works across event loops (WSGI runs each async view in its own loop), so
+    waiters are plain futures woken through their loop's call_soon_threadsafe.
+    """
+
+    def __init__(self, concurrency, queue):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.running = 0
+        self.waiters = deque()
+        self.lock = threading.Lock()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.running < self.concurrency:
+                self.running += 1
+                return
+            if len(self.waiters) >= self.queue:
+                raise OperationRejected()
+            waiter = loop.create_future()
+            self.waiters.append((loop, waiter))
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self.lock:
+                if (loop, waiter) in self.waiters:
+                    self.waiters.remove((loop, waiter))
+                    raise
+            # The slot was already handed over; _wake releases it if the
+            # future was cancelled first, otherwise give it back here.
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            if not self.waiters:
+                self.running -= 1
+                return
+            loop, waiter = self.waiters.popleft()
+        # The running count is handed straight to the next waiter
+        loop.call_soon_threadsafe(self._wake, waiter)
+
+    def _wake(self, waiter):
+        if waiter.cancelled():
+            self.release()
+        else:
+            waiter.set_result(None)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_limiters = {}
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'TOOL_EXECUTOR_WORKERS', 4)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tools')
+        return _executor
+
+
+def get_limiter(operation):
+    with _executor_lock:
+        if operation not in _limiters:
+            limits = getattr(settings, 'OPERATION_LIMITS', {})
+            config = {'concurrency': 2, 'queue': 8}
+            config.update(limits.get('default', {}))
+            config.update(limits.get(operation, {}))
+            _limiters[operation] = OperationLimiter(config['concurrency'], config['queue'])
+        return _limiters[operation]
+
+
+def _busy(request, template):
+    response = render(request, template, {'error': 'The server is busy. Please try again shortly.'}, status=503)
+    response['Retry-After'] = str(getattr(settings, 'OPERATION_RETRY_AFTER', 10))
+    return response
+
+
+async def _reserve_memory(amount):
+    # Sleep until a release frees part of the global memory budget, then retry
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + getattr(settings, 'ADMISSION_QUEUE_TIMEOUT', 30)
+    while True:
+        waiter = (loop, loop.create_future())
+        if admission.global_budget.try_reserve(amount, waiter):
+            return True
+        try:
+            await asyncio.wait_for(waiter[1], max(0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            admission.global_budget.discard(waiter)
+
+
+def offload(operation, template):
+    """Turn a sync tool view into an async view that runs on the bounded executor.
+
+    When the operation's queue is full the request is rejected with a 503 and
+    a Retry-After header instead of piling up threads and memory. The request's
+    cost is estimated before any work starts: over the per-request budget it is
+    downgraded or rejected with a 413, and it waits for room in the global
+    memory budget. The admitted cost is available to the view as request.cost.
+    """
+    def decorator(view):
+        run_view = sync_to_async(view, thread_sensitive=False, executor=get_executor())
+        run_estimate = sync_to_async(admission.estimate, thread_sensitive=False, executor=get_executor())
+
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != 'POST':
+                return await sync_to_async(view)(request, *args, **kwargs)
+
+            limiter = get_limiter(operation)
+            try:
+                await limiter.acquire()
+            except OperationRejected:
+                return _busy(request, template)
+            try:
+                try:
+                    costs = await run_estimate(operation, request)
+                    request.cost = admission.choose(costs) if costs else None
+                except admission.OverBudget as e:
+                    return render(request, template, {'error': str(e)}, status=413)
+                if request.cost is not None and not await _reserve_memory(request.cost.memory):
+                    return _busy(request, template)
+                try:
+                    return await run_view(request, *args, **kwargs)
+                finally:
+                    if request.cost is not None:
+                        admission.global_budget.release(request.cost.memory)
+            finally:
+                limiter.release()
+        return wrapper
+    return decorator
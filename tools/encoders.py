@@ -0,0 +1,150 @@
+import io
+import time
+from django.conf import settings
+from django.http import FileResponse
+from django.utils.cache import patch_vary_headers
+from PIL import Image
+
+
+# Output formats: name -> (Pillow format, content type, file extension)
+FORMATS = {
+    'png': ('PNG', 'image/png', 'png'),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'avif': ('AVIF', 'image/avif', 'avif'),
+}
+
+FORMAT_ALIASES = {
+    'jpg': 'jpeg',
+}
+
+LOSSY_FORMATS = ('jpeg', 'webp', 'avif')
+
+# Speed/size presets: trade encode CPU for output bytes
+PRESETS = {
+    'fast': {
+        'png': {'compress_level': 1},
+        'jpeg': {'optimize': False, 'progressive': False},
+        'webp': {'method': 0},
+        'avif': {'speed': 10},
+    },
+    'balanced': {
+        'png': {'compress_level': 6},
+        'jpeg': {'optimize': True, 'progressive': False},
+        'webp': {'method': 4},
+        'avif': {'speed': 6},
+    },
+    'small': {
+        'png': {'compress_level': 9, 'optimize': True},
+        'jpeg': {'optimize': True, 'progressive': True},
+        'webp': {'method': 6},
+        'avif': {'speed': 2},
+    },
+}
+
+
+def available_formats():
+    # AVIF (and WebP on minimal builds) depends on how Pillow was compiled
+    Image.init()
+    return [name for name, (pil_format, _, _) in FORMATS.items() if pil_format in Image.SAVE]
+
+
+def normalize_format(name):
+    name = (name or '').strip().lower()
+    if name.startswith('image/'):
+        name = name[len('image/'):]
+    return FORMAT_ALIASES.get(name, name)
+
+
+def _accepted_image_formats(accept_header):
+    # Parse the Accept header into media types ordered by q-value, keeping header order on ties
+    ranked = []
+    for position, item in enumerate(accept_header.split(',')):
+        parts = [p.strip() for p in item.split(';')]
+        media_type = parts[0].lower()
+        if not media_type:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            ranked.append((-q, position, media_type))
+    ranked.sort()
+    return [media_type for _, _, media_type in ranked]
+
+
+def negotiate_format(request, default, allowed=None):
+    """Pick the output format from the `output_format` field, then the Accept header."""
+    supported = available_formats()
+    if allowed is not None:
+        supported = [name for name in supported if name in allowed]
+
+    requested = normalize_format(request.POST.get('output_format') or request.GET.get('output_format'))
+    if requested in supported:
+        return requested
+
+    # Only honour Accept when the client prefers an image over everything else;
+    # browser form posts lead with text/html and keep the endpoint default.
+    media_types = _accepted_image_formats(request.META.get('HTTP_ACCEPT', ''))
+    if media_types and media_types[0].startswith('image/'):
+        for media_type in media_types:
+            if not media_type.startswith('image/'):
+                break
+            name = normalize_format(media_type)
+            if name in supported:
+                return name
+    return default
+
+
+def get_preset(request):
+    preset = (request.POST.get('preset') or request.GET.get('preset') or '').strip().lower()
+    if preset in PRESETS:
+        return preset
+    return getattr(settings, 'IMAGE_ENCODE_PRESET', 'balanced')
+
+
+def prepare_image(img, fmt):
+    """Convert `img` to a mode `fmt` can store; returns `img` itself when it already fits."""
+    # JPEG has no alpha or palette support
+    if fmt == 'jpeg' and img.mode not in ('RGB', 'L', 'CMYK'):
+        return img.convert('RGB')
+    if fmt in ('webp', 'avif') and img.mode not in ('RGB', 'RGBA'):
+        return img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+    return img
+
+
+def encode_image(img, fmt, preset='balanced', quality=None, output=None):
+    """Encode `img` into `output` (a new BytesIO by default); returns (output, seconds)."""
+    pil_format = FORMATS[fmt][0]
+    options = dict(PRESETS.get(preset, PRESETS['balanced'])[fmt])
+    if quality is not None and fmt in LOSSY_FORMATS:
+        options['quality'] = quality
+
+    img = prepare_image(img, fmt)
+    # Decode lazily opened sources first so only the encode itself is timed
+    img.load()
+    if output is None:
+        output = io.BytesIO()
+    start = time.perf_counter()
+    img.save(output, format=pil_format, **options)
+    return output, time.perf_counter() - start
+
+
+def server_timing(timings):
+    # timings: iterable of (name, seconds)
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings)
+
+
+def image_response(output, fmt, basename, encode_seconds):
+    output.seek(0)
+    _, content_type, extension = FORMATS[fmt]
+    response = FileResponse(output, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{basename}.{extension}"'
+    response['Server-Timing'] = server_timing([('encode', encode_seconds)])
+    # The format may have come from the Accept header, so caches must key on it
+    patch_vary_headers(response, ['Accept'])
+    return response
@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image, TiffImagePlugin
+
+
+def _run_case(path, engine, operation, size):
+    # Runs in a fresh worker process so ru_maxrss reflects this case alone
+    from tools import tiles
+
+    # Workers don't run ToolsConfig.ready, so apply its pixel limit here
+    Image.MAX_IMAGE_PIXELS = getattr(settings, 'IMAGE_MAX_PIXELS', Image.MAX_IMAGE_PIXELS)
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        if engine == 'baseline':
+            pass
+        elif engine == 'full':
+            img = Image.open(f)
+            if operation == 'crop':
+                img.crop(_center_box(img.size, size)).load()
+            else:
+                img.resize(size, Image.Resampling.LANCZOS)
+        else:
+            img = tiles.open_image(f)
+            if operation == 'crop':
+                tiles.crop(f, _center_box(img.size, size), limit=float('inf'))
+            else:
+                tiles.resize(f, size, limit=float('inf'))
+    elapsed = time.perf_counter() - start
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _center_box(image_size, size):
+    left = (image_size[0] - size[0]) // 2
+    top = (image_size[1] - size[1]) // 2
+    return (left, top, left + size[0], top + size[1])
+
+
+class Command(BaseCommand):
+    help = 'Compare peak RSS and latency of the tiled image engine against full decoding.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=8000, help='Width and height of the test image')
+        parser.add_argument('--formats', default='tiff,png,jpeg')
+        parser.add_argument('--crop', type=int, default=512, help='Side of the centred crop box')
+        parser.add_argument('--thumbnail', type=int, default=1024, help='Side of the resize target')
+
+    def handle(self, *args, **options):
+        side = options['size']
+        size = (side, side)
+
+        # Workers fork from a small server started before the test image exists;
+        # ru_maxrss survives fork and exec, so forking from this process would skew it
+        context = multiprocessing.get_context('forkserver')
+        with tempfile.TemporaryDirectory() as tmp, context.Pool(1, maxtasksperchild=1) as pool:
+            image = Image.merge('RGB', (
+                Image.radial_gradient('L').resize(size),
+                Image.linear_gradient('L').resize(size),
+                Image.effect_noise(size, 30),
+            ))
+            paths = {}
+            for fmt in options['formats'].split(','):
+                path = os.path.join(tmp, f'source.{fmt}')
+                if fmt == 'tiff':
+                    # Write through libtiff for a striped file, as scanners produce
+                    TiffImagePlugin.WRITE_LIBTIFF = True
+                    image.save(path, format='TIFF')
+                    TiffImagePlugin.WRITE_LIBTIFF = False
+                elif fmt == 'png':
+                    image.save(path, format='PNG', compress_level=1)
+                else:
+                    image.save(path, format='JPEG', quality=90)
+                paths[fmt] = path
+            del image
+
+            baseline = pool.apply(_run_case, (paths[next(iter(paths))], 'baseline', None, None))[1]
+            self.stdout.write(f'{side}x{side} source, process baseline RSS {baseline / 1024 / 1024:.0f} MB')
+            self.stdout.write(f'{"format":6} {"operation":10} {"engine":6} {"latency":>10} {"peak RSS":>10}')
+
+            cases = [('crop', (options['crop'], options['crop'])), ('resize', (options['thumbnail'], options['thumbnail']))]
+            for fmt, path in paths.items():
+                for operation, target in cases:
+                    for engine in ('full', 'tiled'):
+                        elapsed, rss = pool.apply(_run_case, (path, engine, operation, target))
+                        self.stdout.write(
+                            f'{fmt:6} {operation:10} {engine:6} {elapsed * 1000:8.0f}ms {(rss - baseline) / 1024 / 1024:8.0f}MB'
+                        )
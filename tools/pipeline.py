@@ -0,0 +1,205 @@
+import io
+import json
+import time
+import pikepdf
+
+
+PIPELINE_OPERATIONS = ('merge', 'delete_page', 'watermark', 'encrypt', 'compress')
+
+
+class PipelineError(Exception):
+    pass
+
+
+def watermark_overlay(text, page_width, page_height):
+    """Render a one-page PDF with `text` centred diagonally, sized for the given page."""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.colors import Color
+
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=(page_width, page_height))
+    # Try setting alpha if available; ignore if not
+    try:
+        c.setFillAlpha(0.25)
+    except Exception:
+        pass
+
+    c.saveState()
+    c.translate(page_width / 2.0, page_height / 2.0)
+    c.rotate(45)
+    c.setFillColor(Color(0.5, 0.5, 0.5))
+    c.setFont("Helvetica", int(min(page_width, page_height) / 8))
+    c.drawCentredString(0, 0, text)
+    c.restoreState()
+    c.save()
+    buffer.seek(0)
+    return buffer
+
+
+def rasterize_pdf(pdf_bytes, target_bytes, dpis):
+    """Re-render `pdf_bytes` as images at decreasing DPI/quality until it fits `target_bytes`.
+
+    Returns the first output under the target, else the smallest one produced,
+    else None if nothing came out smaller than the input.
+    """
+    from pdf2image import convert_from_bytes
+
+    best_output = None
+    best_size = len(pdf_bytes)
+
+    for dpi in dpis:
+        try:
+            images = convert_from_bytes(pdf_bytes, dpi=dpi)
+            if not images:
+                continue
+
+            # Convert all images to RGB
+            rgb_images = [img.convert('RGB') for img in images]
+
+            # Try different quality levels
+            for quality in [95, 85, 75, 65, 55, 45, 35, 25, 15]:
+                try:
+                    output = io.BytesIO()
+                    rgb_images[0].save(
+                        output,
+                        format='PDF',
+                        save_all=True,
+                        append_images=rgb_images[1:],
+                        quality=quality,
+                        optimize=True,
+                        compress_level=9
+                    )
+                    output_size = output.tell()
+                    output.seek(0)
+
+                    if output_size <= target_bytes:
+                        return output
+
+                    # Keep track of best compression
+                    if output_size < best_size:
+                        best_output = output
+                        best_size = output_size
+                except Exception:
+                    continue
+        except Exception:
+            continue
+
+    return best_output
+
+
+def parse_operations(raw):
+    """Parse the `operations` field: a JSON list of {"op": name, ...params} objects."""
+    try:
+        steps = json.loads(raw or '[]')
+    except ValueError:
+        raise PipelineError('Operations must be a JSON list.')
+    if not isinstance(steps, list) or not steps:
+        raise PipelineError('Operations must be a non-empty JSON list.')
+    for step in steps:
+        if not isinstance(step, dict) or step.get('op') not in PIPELINE_OPERATIONS:
+            raise PipelineError(f'Unknown operation: {step!r}. Expected one of {", ".join(PIPELINE_OPERATIONS)}.')
+    if any(step['op'] == 'compress' for step in steps[:-1]):
+        raise PipelineError('compress must be the last operation.')
+    # A second merge would append the other uploads again
+    if sum(step['op'] == 'merge' for step in steps) > 1:
+        raise PipelineError('merge can only appear once.')
+    return steps
+
+
+class Pipeline:
+    """Runs PDF operations against one in-memory pikepdf document.
+
+    Uploads are parsed once; encryption is applied when the document is
+    serialized at the end, and compress (which rasterizes) runs on that single
+    serialized copy.
+    """
+
+    def __init__(self, files, dpis):
+        self.dpis = dpis
+        self.sources = []
+        try:
+            for f in files:
+                self.sources.append(pikepdf.open(io.BytesIO(f.read())))
+        except Exception:
+            # A later upload failed to parse; don't leak the ones already open
+            self.close()
+            raise
+        self.pdf = self.sources[0]
+        self.password = None
+        self.compress = None
+        self.timings = []
+
+    def run(self, steps):
+        if len(self.sources) > 1 and not any(step['op'] == 'merge' for step in steps):
+            raise PipelineError(f'{len(self.sources)} PDFs were uploaded but there is no merge operation.')
+        for i, step in enumerate(steps, start=1):
+            start = time.perf_counter()
+            getattr(self, f'_{step["op"]}')(step)
+            self.timings.append((f'{step["op"]}-{i}', time.perf_counter() - start))
+        return self.save()
+
+    def _merge(self, step):
+        for source in self.sources[1:]:
+            self.pdf.pages.extend(source.pages)
+
+    def _delete_page(self, step):
+        page_num = int(step.get('page_num', 1)) - 1  # Convert to 0-indexed
+        if not 0 <= page_num < len(self.pdf.pages):
+            raise PipelineError(f'Page {page_num + 1} does not exist.')
+        del self.pdf.pages[page_num]
+
+    def _watermark(self, step):
+        text = step.get('text', 'WATERMARK')
+        overlays = {}
+        for page in self.pdf.pages:
+            box = page.mediabox
+            size = (float(box[2]) - float(box[0]), float(box[3]) - float(box[1]))
+            # One overlay per distinct page size, shared by every page of that size
+            if size not in overlays:
+                with pikepdf.open(watermark_overlay(text, *size)) as overlay_pdf:
+                    overlays[size] = self.pdf.copy_foreign(overlay_pdf.pages[0].as_form_xobject())
+            page.add_overlay(overlays[size])
+
+    def _encrypt(self, step):
+        self.password = step.get('password', '')
+
+    def _compress(self, step):
+        size = float(step.get('size', 1.0))
+        unit = step.get('unit', 'mb')
+        self.compress = size * 1024 if unit == 'kb' else size * 1024 * 1024
+
+    def _serialize(self, pdf, encrypt):
+        output = io.BytesIO()
+        if encrypt and self.password is not None:
+            pdf.save(output, encryption=pikepdf.Encryption(owner=self.password, user=self.password))
+        else:
+            pdf.save(output)
+        output.seek(0)
+        return output
+
+    def save(self):
+        start = time.perf_counter()
+        if self.compress is None:
+            output = self._serialize(self.pdf, encrypt=True)
+            self.timings.append(('save', time.perf_counter() - start))
+            return output
+
+        # Rasterize the unencrypted document, then encrypt the compressed result
+        pdf_bytes = self._serialize(self.pdf, encrypt=False).getvalue()
+        self.timings.append(('save', time.perf_counter() - start))
+
+        start = time.perf_counter()
+        output = None
+        if len(pdf_bytes) > self.compress:
+            output = rasterize_pdf(pdf_bytes, self.compress, self.dpis)
+        if output is None:
+            output = io.BytesIO(pdf_bytes)
+        if self.password is not None:
+            with pikepdf.open(output) as compressed:
+                output = self._serialize(compressed, encrypt=True)
+        self.timings.append(('rasterize', time.perf_counter() - start))
+        return output
+
+    def close(self):
+        for source in self.sources:
+            source.close()
@@ -1,3 +1,545 @@
-from django.test import TestCase
+import asyncio
+import io
+import os
+import threading
+import time
+import zipfile
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+from PIL import Image, ImageChops, TiffImagePlugin
+import pikepdf
 
-# Create your tests here.
+from . import admission, concurrency, encoders, pipeline, tiles
+from .archives import ArchiveWriter
+
+
+class AcceptedImageFormatsTests(SimpleTestCase):
+    def test_orders_by_q_value(self):
+        accept = 'image/png;q=0.5, image/avif, image/webp;q=0.8'
+        self.assertEqual(
+            encoders._accepted_image_formats(accept),
+            ['image/avif', 'image/webp', 'image/png'],
+        )
+
+    def test_ties_keep_header_order(self):
+        accept = 'image/webp;q=0.9, image/png;q=0.9, image/jpeg'
+        self.assertEqual(
+            encoders._accepted_image_formats(accept),
+            ['image/jpeg', 'image/webp', 'image/png'],
+        )
+
+    def test_drops_zero_and_malformed_q(self):
+        accept = 'image/avif;q=0, image/webp;q=abc, image/png'
+        self.assertEqual(encoders._accepted_image_formats(accept), ['image/png'])
+
+    def test_empty_header(self):
+        self.assertEqual(encoders._accepted_image_formats(''), [])
+
+
+class NegotiateFormatTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_browser_accept_keeps_default(self):
+        request = self.factory.post('/', HTTP_ACCEPT='text/html,application/xhtml+xml,image/webp,*/*;q=0.8')
+        self.assertEqual(encoders.negotiate_format(request, default='png'), 'png')
+
+    def test_image_accept_is_honoured(self):
+        request = self.factory.post('/', HTTP_ACCEPT='image/webp, image/png;q=0.5')
+        self.assertEqual(encoders.negotiate_format(request, default='png'), 'webp')
+
+    def test_image_response_varies_on_accept(self):
+        output, seconds = encoders.encode_image(Image.new('RGB', (4, 4)), 'png')
+        response = encoders.image_response(output, 'png', 'out', seconds)
+        self.assertIn('Accept', response['Vary'])
+
+
+def _png_upload(size=(64, 48), mode='RGB'):
+    output = io.BytesIO()
+    Image.new(mode, size, 'red').save(output, format='PNG')
+    return SimpleUploadedFile('in.png', output.getvalue(), content_type='image/png')
+
+
+class EncodeImageTests(SimpleTestCase):
+    def test_decode_is_not_timed(self):
+        img = Image.open(_png_upload())
+        real_load = img.load
+
+        def slow_load():
+            # Only the first call actually decodes; later calls are no-ops
+            if img.tile:
+                time.sleep(0.2)
+            return real_load()
+
+        img.load = slow_load
+        _, seconds = encoders.encode_image(img, 'png', 'fast')
+        self.assertLess(seconds, 0.1)
+
+    def test_output_format_and_preset_reach_save(self):
+        real_save = Image.Image.save
+        with mock.patch.object(Image.Image, 'save', autospec=True, side_effect=real_save) as save:
+            response = Client().post(reverse('compress_image'), {
+                'image': _png_upload(), 'output_format': 'webp', 'preset': 'fast', 'quality': 60,
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        kwargs = save.call_args.kwargs
+        self.assertEqual(kwargs['format'], 'WEBP')
+        self.assertEqual(kwargs['method'], encoders.PRESETS['fast']['webp']['method'])
+        self.assertEqual(kwargs['quality'], 60)
+
+    @override_settings(IMAGE_ENCODE_PRESET='small')
+    def test_preset_defaults_to_setting(self):
+        real_save = Image.Image.save
+        with mock.patch.object(Image.Image, 'save', autospec=True, side_effect=real_save) as save:
+            response = Client().post(reverse('resize_pixels'), {
+                'image': _png_upload(), 'width': 32, 'height': 24, 'output_format': 'png',
+            })
+        self.assertEqual(response.status_code, 200)
+        kwargs = save.call_args.kwargs
+        self.assertEqual(kwargs['format'], 'PNG')
+        self.assertEqual(kwargs['compress_level'], 9)
+
+
+class ArchiveWriterTests(SimpleTestCase):
+    def test_members_read_back_with_compression_by_extension(self):
+        members = {'page_1.jpg': b'\xff\xd8' * 500, 'page_2.PNG': b'png' * 500, 'page_3.webp': b'w' * 1000, 'notes.txt': b'a' * 1000}
+        with ArchiveWriter() as archive:
+            for name, data in members.items():
+                with archive.open(name) as member:
+                    member.write(data)
+            output = archive.close()
+
+        with zipfile.ZipFile(output) as archive:
+            self.assertIsNone(archive.testzip())
+            for name, data in members.items():
+                self.assertEqual(archive.read(name), data)
+            compression = {info.filename: info.compress_type for info in archive.infolist()}
+        self.assertEqual(compression, {
+            'page_1.jpg': zipfile.ZIP_STORED,
+            'page_2.PNG': zipfile.ZIP_STORED,
+            'page_3.webp': zipfile.ZIP_STORED,
+            'notes.txt': zipfile.ZIP_DEFLATED,
+        })
+
+    def test_large_member_forces_zip64(self):
+        with ArchiveWriter() as archive:
+            with archive.open('huge.ppm', large=True) as member:
+                member.write(b'P' * 1000)
+            with archive.open('small.ppm') as member:
+                member.write(b'p' * 1000)
+            output = archive.close()
+
+        with zipfile.ZipFile(output) as archive:
+            self.assertGreaterEqual(archive.getinfo('huge.ppm').extract_version, zipfile.ZIP64_VERSION)
+            self.assertLess(archive.getinfo('small.ppm').extract_version, zipfile.ZIP64_VERSION)
+            self.assertEqual(archive.read('huge.ppm'), b'P' * 1000)
+
+    def test_spools_to_disk_past_memory_size(self):
+        data = os.urandom(16 * 1024)
+        with ArchiveWriter(max_memory_size=1024) as archive:
+            with archive.open('data.bin') as member:
+                member.write(data)
+            self.assertTrue(archive.file._rolled)
+            output = archive.close()
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(archive.read('data.bin'), data)
+
+    def test_exception_closes_spooled_file(self):
+        with self.assertRaises(RuntimeError):
+            with ArchiveWriter() as archive:
+                with archive.open('page_1.png') as member:
+                    member.write(b'partial')
+                raise RuntimeError('encode failed')
+        self.assertTrue(archive.file.closed)
+
+
+class OperationLimiterTests(SimpleTestCase):
+    async def test_release_hands_slot_to_waiter(self):
+        limiter = concurrency.OperationLimiter(concurrency=1, queue=1)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        self.assertFalse(waiter.done())
+
+        limiter.release()
+        await asyncio.wait_for(waiter, 1)
+        self.assertEqual(limiter.running, 1)
+        limiter.release()
+        self.assertEqual(limiter.running, 0)
+
+    async def test_full_queue_rejects(self):
+        limiter = concurrency.OperationLimiter(concurrency=1, queue=1)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        with self.assertRaises(concurrency.OperationRejected):
+            await limiter.acquire()
+        waiter.cancel()
+        limiter.release()
+
+    async def test_cancelled_waiter_does_not_leak_slot(self):
+        limiter = concurrency.OperationLimiter(concurrency=1, queue=2)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+
+        limiter.release()
+        self.assertEqual(limiter.running, 0)
+        self.assertFalse(limiter.waiters)
+
+    async def test_waiter_cancelled_after_handover_releases_slot(self):
+        limiter = concurrency.OperationLimiter(concurrency=1, queue=1)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        # The wake-up is scheduled but the waiter is cancelled before it runs
+        limiter.release()
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+        self.assertEqual(limiter.running, 0)
+
+
+@override_settings(OPERATION_LIMITS={'test_busy': {'concurrency': 1, 'queue': 1}}, OPERATION_RETRY_AFTER=7)
+class OffloadTests(SimpleTestCase):
+    def setUp(self):
+        concurrency._limiters.pop('test_busy', None)
+        self.addCleanup(concurrency._limiters.pop, 'test_busy', None)
+        self.factory = RequestFactory()
+
+    async def test_full_queue_returns_503_with_retry_after(self):
+        started = threading.Event()
+        finish = threading.Event()
+
+        @concurrency.offload('test_busy', 'images.html')
+        def view(request):
+            started.set()
+            finish.wait(5)
+            return HttpResponse('done')
+
+        running = asyncio.ensure_future(view(self.factory.post('/')))
+        await asyncio.to_thread(started.wait, 5)
+        queued = asyncio.ensure_future(view(self.factory.post('/')))
+        await asyncio.sleep(0)
+
+        rejected = await view(self.factory.post('/'))
+        self.assertEqual(rejected.status_code, 503)
+        self.assertEqual(rejected['Retry-After'], '7')
+
+        finish.set()
+        self.assertEqual((await running).status_code, 200)
+        self.assertEqual((await queued).status_code, 200)
+        self.assertEqual(concurrency.get_limiter('test_busy').running, 0)
+
+
+def _pdf_upload(pages=2, encrypt=None):
+    pdf = pikepdf.new()
+    for _ in range(pages):
+        pdf.add_blank_page(page_size=(612, 792))
+    output = io.BytesIO()
+    if encrypt:
+        pdf.save(output, encryption=encrypt)
+    else:
+        pdf.save(output)
+    return SimpleUploadedFile('in.pdf', output.getvalue(), content_type='application/pdf')
+
+
+class AdmissionTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_owner_password_pdf_is_estimated(self):
+        upload = _pdf_upload(pages=3, encrypt=pikepdf.Encryption(owner='secret', user='', aes=True))
+        costs = admission.estimate('pdf_to_images', self.factory.post('/', {'pdf': upload}))
+        self.assertEqual([cost.dpi for cost in costs], admission.PDF_TO_IMAGES_DPIS)
+        pixels = 3 * (612 / 72 * 200) * (792 / 72 * 200)
+        self.assertGreaterEqual(costs[0].memory, pixels * 4)
+
+    @override_settings(ADMISSION_UNREADABLE_INPUT_FACTOR=20)
+    def test_unreadable_input_gets_conservative_cost(self):
+        upload = SimpleUploadedFile('in.pdf', b'not a pdf' * 100)
+        costs = admission.estimate('compress_pdf', self.factory.post('/', {'pdf': upload}))
+        self.assertEqual(len(costs), 1)
+        self.assertEqual(costs[0].memory, 900 * 20)
+        self.assertEqual(costs[0].dpi, admission.COMPRESS_PDF_DPIS[-1])
+
+    def test_rgb_images_are_charged_four_bytes_per_pixel(self):
+        output = io.BytesIO()
+        Image.new('RGB', (100, 50)).save(output, format='PNG')
+        upload = SimpleUploadedFile('in.png', output.getvalue())
+        costs = admission.estimate('compress_image', self.factory.post('/', {'image': upload}))
+        self.assertEqual(costs[0].memory, 100 * 50 * 4 * 2)
+
+
+class PipelineTests(SimpleTestCase):
+    def test_estimate_parses_operations(self):
+        # "compress" inside a parameter must not count as a compress step
+        operations = '[{"op": "watermark", "text": "compress"}]'
+        request = RequestFactory().post('/', {'pdfs': _pdf_upload(), 'operations': operations})
+        costs = admission.estimate('pdf_pipeline', request)
+        self.assertEqual([cost.dpi for cost in costs], [None])
+
+        operations = '[{"op": "watermark", "text": "x"}, {"op": "compress", "size": 1}]'
+        request = RequestFactory().post('/', {'pdfs': _pdf_upload(), 'operations': operations})
+        costs = admission.estimate('pdf_pipeline', request)
+        self.assertEqual([cost.dpi for cost in costs], admission.COMPRESS_PDF_DPIS)
+
+    def test_several_pdfs_need_merge(self):
+        runner = pipeline.Pipeline([_pdf_upload(), _pdf_upload()], [])
+        try:
+            with self.assertRaises(pipeline.PipelineError):
+                runner.run([{'op': 'delete_page', 'page_num': 1}])
+            output = runner.run([{'op': 'merge'}])
+        finally:
+            runner.close()
+        with pikepdf.open(output) as merged:
+            self.assertEqual(len(merged.pages), 4)
+
+    def test_operations_are_validated(self):
+        with self.assertRaisesMessage(pipeline.PipelineError, 'compress must be the last operation'):
+            pipeline.parse_operations('[{"op": "compress", "size": 1}, {"op": "watermark"}]')
+        with self.assertRaisesMessage(pipeline.PipelineError, 'merge can only appear once'):
+            pipeline.parse_operations('[{"op": "merge"}, {"op": "merge"}]')
+        with self.assertRaises(pipeline.PipelineError):
+            pipeline.parse_operations('[{"op": "rotate"}]')
+
+    def test_watermark_shares_one_overlay_per_page_size(self):
+        pdf = pikepdf.new()
+        for size in ((612, 792), (612, 792), (842, 595)):
+            pdf.add_blank_page(page_size=size)
+        upload = io.BytesIO()
+        pdf.save(upload)
+        upload.seek(0)
+
+        runner = pipeline.Pipeline([upload], [])
+        try:
+            runner.run([{'op': 'watermark', 'text': 'DRAFT'}])
+            overlays = [
+                [xobject.objgen for xobject in page.Resources.XObject.values()]
+                for page in runner.pdf.pages
+            ]
+        finally:
+            runner.close()
+        self.assertEqual([len(names) for names in overlays], [1, 1, 1])
+        self.assertEqual(overlays[0], overlays[1])
+        self.assertNotEqual(overlays[0], overlays[2])
+
+    def test_delete_page_and_encrypt(self):
+        runner = pipeline.Pipeline([_pdf_upload(pages=3)], [])
+        try:
+            output = runner.run([{'op': 'delete_page', 'page_num': 2}, {'op': 'encrypt', 'password': 'secret'}])
+        finally:
+            runner.close()
+        with self.assertRaises(pikepdf.PasswordError):
+            pikepdf.open(io.BytesIO(output.getvalue()))
+        with pikepdf.open(output, password='secret') as result:
+            self.assertTrue(result.is_encrypted)
+            self.assertEqual(len(result.pages), 2)
+
+    def test_compress_keeps_output_when_already_under_target(self):
+        runner = pipeline.Pipeline([_pdf_upload()], [75])
+        try:
+            output = runner.run([{'op': 'compress', 'size': 10, 'unit': 'mb'}])
+        finally:
+            runner.close()
+        with pikepdf.open(output) as result:
+            self.assertEqual(len(result.pages), 2)
+        self.assertEqual([name for name, _ in runner.timings], ['compress-1', 'save', 'rasterize'])
+
+    def test_view_reports_step_timings(self):
+        operations = '[{"op": "merge"}, {"op": "watermark", "text": "DRAFT"}, {"op": "encrypt", "password": "x"}]'
+        response = Client().post(reverse('pdf_pipeline'), {
+            'pdfs': [_pdf_upload(), _pdf_upload()], 'operations': operations,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        names = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(names, ['merge-1', 'watermark-2', 'encrypt-3', 'save'])
+
+    def test_open_failure_closes_parsed_sources(self):
+        opened = []
+        real_open = pikepdf.open
+
+        def tracking_open(*args, **kwargs):
+            pdf = mock.Mock(wraps=real_open(*args, **kwargs))
+            opened.append(pdf)
+            return pdf
+
+        bad = SimpleUploadedFile('bad.pdf', b'not a pdf')
+        with mock.patch.object(pipeline.pikepdf, 'open', tracking_open):
+            with self.assertRaises(pikepdf.PdfError):
+                pipeline.Pipeline([_pdf_upload(), bad], [])
+        self.assertEqual(len(opened), 1)
+        opened[0].close.assert_called_once()
+
+
+@override_settings(ADMISSION_GLOBAL_MEMORY=100, ADMISSION_QUEUE_TIMEOUT=5)
+class MemoryBudgetTests(SimpleTestCase):
+    def setUp(self):
+        self.budget = admission.MemoryBudget()
+        self.budget.try_reserve(80)
+
+    async def test_release_wakes_waiter(self):
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        self.assertFalse(self.budget.try_reserve(50, waiter))
+
+        await asyncio.to_thread(self.budget.release, 80)
+        await asyncio.wait_for(waiter[1], 1)
+        self.assertTrue(self.budget.try_reserve(50))
+        self.assertEqual(self.budget.waiters, [])
+
+    async def test_reserve_memory_waits_for_release(self):
+        original = admission.global_budget
+        admission.global_budget = self.budget
+        self.addCleanup(setattr, admission, 'global_budget', original)
+
+        pending = asyncio.ensure_future(concurrency._reserve_memory(50))
+        await asyncio.sleep(0)
+        self.assertFalse(pending.done())
+        self.budget.release(80)
+        self.assertTrue(await asyncio.wait_for(pending, 1))
+        self.assertEqual(self.budget.used, 50)
+
+    @override_settings(ADMISSION_QUEUE_TIMEOUT=0.05)
+    async def test_reserve_memory_times_out(self):
+        original = admission.global_budget
+        admission.global_budget = self.budget
+        self.addCleanup(setattr, admission, 'global_budget', original)
+
+        self.assertFalse(await concurrency._reserve_memory(50))
+        self.assertEqual(self.budget.waiters, [])
+
+
+def _source_image(size=(600, 400)):
+    return Image.merge('RGB', (
+        Image.linear_gradient('L').resize(size),
+        Image.radial_gradient('L').resize(size),
+        Image.effect_noise(size, 40),
+    ))
+
+
+def _encoded(image, format, **params):
+    output = io.BytesIO()
+    if format == 'TIFF':
+        # libtiff writes uncompressed files in strips, as scanners do
+        with mock.patch.object(TiffImagePlugin, 'WRITE_LIBTIFF', True):
+            image.save(output, format=format, **params)
+    else:
+        image.save(output, format=format, **params)
+    output.seek(0)
+    return output
+
+
+def _max_difference(a, b):
+    return max(high for _, high in ImageChops.difference(a, b).getextrema())
+
+
+@override_settings(IMAGE_DECODE_MEMORY_LIMIT=64 * 1024 * 1024, IMAGE_BAND_MEMORY=900 * 1024)
+class TilesTests(SimpleTestCase):
+    box = (130, 250, 370, 330)
+
+    def assert_matches_full_decode(self, source, tolerance=0):
+        full = Image.open(source)
+        full.load()
+        self.assertEqual(_max_difference(tiles.crop(source, self.box), full.crop(self.box)), 0)
+        resized = tiles.resize(source, (150, 100))
+        self.assertLessEqual(_max_difference(resized, full.resize((150, 100), Image.Resampling.LANCZOS)), tolerance)
+
+    def test_striped_tiff_decodes_only_covering_strips(self):
+        source = _encoded(_source_image(), 'TIFF')
+        img = tiles.open_image(source)
+        self.assertTrue(tiles._is_tiled(img))
+        self.assertLess(tiles.crop_bytes(img, self.box), 600 * 400 * 4)
+        self.assertTrue(tiles._is_banded(img, (150, 100), tiles.memory_limit()))
+        # Band edges resample independently, so allow rounding differences
+        self.assert_matches_full_decode(source, tolerance=2)
+
+    def test_png_rows(self):
+        source = _encoded(_source_image(), 'PNG')
+        self.assertEqual(tiles._crop_strategy(tiles.open_image(source), self.box), 'rows')
+        self.assert_matches_full_decode(source)
+
+    def test_ppm_rows(self):
+        source = _encoded(_source_image(), 'PPM')
+        self.assertEqual(tiles._crop_strategy(tiles.open_image(source), self.box), 'rows')
+        self.assert_matches_full_decode(source)
+
+    def test_jpeg_draft(self):
+        source = _encoded(_source_image((1200, 800)), 'JPEG', quality=95)
+        self.assertEqual(tiles._draft_scale(tiles.open_image(source), (150, 100)), 8)
+        resized = tiles.resize(source, (150, 100))
+        full = Image.open(source).resize((150, 100), Image.Resampling.LANCZOS)
+        mean = sum(ImageChops.difference(resized, full).convert('L').getdata()) / (150 * 100)
+        self.assertLess(mean, 4)
+
+    def test_planar_tiles_are_decoded_whole(self):
+        # SGI stores one full-frame tile per band; banding it would re-decode everything per band
+        source = _encoded(_source_image(), 'SGI')
+        img = tiles.open_image(source)
+        self.assertGreater(len(img.tile), 1)
+        self.assertFalse(tiles._is_tiled(img))
+        self.assert_matches_full_decode(source)
+
+    @override_settings(IMAGE_BAND_MEMORY=64 * 1024 * 1024)
+    def test_band_covering_whole_image_falls_back_to_full_decode(self):
+        img = tiles.open_image(_encoded(_source_image(), 'TIFF'))
+        self.assertTrue(tiles._is_tiled(img))
+        self.assertFalse(tiles._is_banded(img, (150, 100), tiles.memory_limit()))
+
+    def test_large_vertical_downscale_decodes_whole(self):
+        # The filter margin alone exceeds the band budget; bands would overlap and
+        # together decode more than the full image
+        source = _encoded(_source_image(), 'TIFF')
+        img = tiles.open_image(source)
+        self.assertIsNone(tiles._band_plan(img, (600, 5), tiles.memory_limit()))
+        self.assertFalse(tiles._is_banded(img, (600, 5), tiles.memory_limit()))
+        self.assertEqual(tiles.resize_bytes(img, (600, 5)), 600 * 400 * 4 + 600 * 5 * 4)
+
+        full = Image.open(source).resize((600, 5), Image.Resampling.LANCZOS)
+        self.assertEqual(_max_difference(tiles.resize(source, (600, 5)), full), 0)
+
+    def test_band_plan_stays_within_band_memory(self):
+        img = tiles.open_image(_encoded(_source_image(), 'TIFF'))
+        out_rows, margin, decoded_rows = tiles._band_plan(img, (150, 100), tiles.memory_limit())
+        self.assertGreaterEqual(out_rows, 1)
+        self.assertLessEqual(2 * 600 * decoded_rows * 4, 900 * 1024)
+        self.assertLess(2 * decoded_rows, 400)
+
+    def test_decode_limit(self):
+        source = _encoded(_source_image(), 'PNG')
+        with self.assertRaises(tiles.DecodeLimitExceeded):
+            tiles.crop(source, self.box, limit=1024)
+        with self.assertRaises(tiles.DecodeLimitExceeded):
+            tiles.resize(source, (150, 100), limit=1024)
+
+    @override_settings(IMAGE_DECODE_MEMORY_LIMIT=1024)
+    def test_admission_applies_decode_limit(self):
+        upload = SimpleUploadedFile('in.png', _encoded(_source_image(), 'PNG').getvalue())
+        request = RequestFactory().post('/', {'image': upload, 'width': 150, 'height': 100})
+        with self.assertRaises(admission.OverBudget):
+            admission.estimate('resize_pixels', request)
+
+    def test_engine_uses_raised_pixel_limit(self):
+        from django.conf import settings
+        self.assertEqual(Image.MAX_IMAGE_PIXELS, settings.IMAGE_MAX_PIXELS)
+        source = _encoded(_source_image(), 'PNG')
+        with mock.patch.object(admission, 'DEFAULT_MAX_PIXELS', 1000):
+            self.assertEqual(tiles.open_image(source).size, (600, 400))
+
+    def test_whole_image_views_keep_default_pixel_cap(self):
+        data = _encoded(_source_image(), 'PNG').getvalue()
+        request = RequestFactory().post('/', {'image': SimpleUploadedFile('in.png', data), 'quality': 75})
+        with mock.patch.object(admission, 'DEFAULT_MAX_PIXELS', 1000):
+            with self.assertRaises(admission.OverBudget):
+                admission.estimate('compress_image', request)
+            response = Client().post(reverse('compress_image'), {'image': SimpleUploadedFile('in.png', data)})
+        self.assertEqual(response.status_code, 413)
@@ -0,0 +1,268 @@
+import math
+from django.conf import settings
+from PIL import Image
+
+
+MB = 1024 * 1024
+
+
+class DecodeLimitExceeded(Exception):
+    pass
+
+
+def memory_limit():
+    return getattr(settings, 'IMAGE_DECODE_MEMORY_LIMIT', 512 * MB)
+
+
+def pixel_bytes(mode):
+    # Pillow stores 8-bit single-band modes in 1 byte, I;16* in 2 and everything else in 4
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def open_image(source):
+    """Open `source` from the start without decoding it.
+
+    Pillow's pixel limit is raised to IMAGE_MAX_PIXELS at startup for this
+    engine, which runs check_memory before anything is decoded.
+    """
+    source.seek(0)
+    return Image.open(source)
+
+
+def _is_tiled(img):
+    # Striped/tiled files (e.g. uncompressed TIFF) expose one tile per strip or tile.
+    # Single-tile formats (PNG, JPEG, libtiff-compressed TIFF) and planar formats
+    # whose tiles each span the whole frame (SGI, PSD) must be decoded whole.
+    full_frame = (0, 0) + img.size
+    return len(img.tile) > 1 and all(
+        tile[0] != 'libtiff' and tuple(tile[1]) != full_frame for tile in img.tile
+    )
+
+
+def _is_streamed(img):
+    # Single-tile decoders that fill rows top to bottom can stop at any row:
+    # raw data stored top-down (PPM, uncompressed TIFF) and non-interlaced PNG.
+    if len(img.tile) != 1:
+        return False
+    name, extents, _, args = img.tile[0]
+    if tuple(extents) != (0, 0) + img.size:
+        return False
+    if name == 'raw':
+        return isinstance(args, str) or len(args) < 3 or args[2] == 1
+    return name == 'zip' and img.format == 'PNG' and not img.info.get('interlace')
+
+
+def _covering_tiles(img, box):
+    left, top, right, bottom = box
+    return [
+        tile for tile in img.tile
+        if tile[1][0] < right and tile[1][2] > left and tile[1][1] < bottom and tile[1][3] > top
+    ]
+
+
+def _retile(tile, extents):
+    # Pillow 11+ describes tiles with the ImageFile._Tile namedtuple; older releases use plain tuples
+    if hasattr(tile, '_replace'):
+        return tile._replace(extents=extents)
+    return (tile[0], extents, tile[2], tile[3])
+
+
+def _union(tiles):
+    return (
+        min(t[1][0] for t in tiles), min(t[1][1] for t in tiles),
+        max(t[1][2] for t in tiles), max(t[1][3] for t in tiles),
+    )
+
+
+def _area(box):
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+def clamp_box(box, size):
+    # Keep crop coordinates within bounds, always at least one pixel wide and tall
+    left, top, right, bottom = box
+    width, height = size
+    left = max(0, min(left, width))
+    top = max(0, min(top, height))
+    right = max(left + 1, min(right, width))
+    bottom = max(top + 1, min(bottom, height))
+    return (left, top, right, bottom)
+
+
+def check_memory(nbytes, limit=None):
+    limit = memory_limit() if limit is None else limit
+    if nbytes > limit:
+        raise DecodeLimitExceeded(
+            f'Decoding this image needs about {nbytes / MB:.0f} MB, above the {limit / MB:.0f} MB limit.'
+        )
+
+
+def _decode_tiles(source, box):
+    """Decode only the tiles intersecting `box`; returns the decoded union and its box."""
+    img = open_image(source)
+    tiles = _covering_tiles(img, box)
+    union = _union(tiles)
+    x0, y0 = union[0], union[1]
+    img.tile = [
+        _retile(tile, (tile[1][0] - x0, tile[1][1] - y0, tile[1][2] - x0, tile[1][3] - y0))
+        for tile in tiles
+    ]
+    img._size = (union[2] - x0, union[3] - y0)
+    img.load()
+    return img, union
+
+
+def _decode_rows(source, bottom):
+    """Decode a streamed single-tile image only down to row `bottom`."""
+    img = open_image(source)
+    img.tile = [_retile(img.tile[0], (0, 0, img.width, bottom))]
+    img._size = (img.width, bottom)
+    img.load()
+    return img
+
+
+def _crop_strategy(img, box):
+    # Boxes reaching past the edge are padded by Pillow, which needs the whole image
+    if box[2] > img.width or box[3] > img.height:
+        return 'full'
+    if _is_tiled(img):
+        return 'tiles'
+    if _is_streamed(img):
+        return 'rows'
+    return 'full'
+
+
+# ==================== COST ====================
+
+def crop_bytes(img, box):
+    """Peak decode memory for cropping `box` out of the (unloaded) image `img`."""
+    per_pixel = pixel_bytes(img.mode)
+    strategy = _crop_strategy(img, box)
+    if strategy == 'tiles':
+        return _area(_union(_covering_tiles(img, box))) * per_pixel + _area(box) * per_pixel
+    if strategy == 'rows':
+        return img.width * box[3] * per_pixel + _area(box) * per_pixel
+    return img.width * img.height * per_pixel + _area(box) * per_pixel
+
+
+def resize_bytes(img, size, limit=None):
+    """Peak decode memory for resizing the (unloaded) image `img` to `size`."""
+    limit = memory_limit() if limit is None else limit
+    per_pixel = pixel_bytes(img.mode)
+    output = size[0] * size[1] * per_pixel
+    if _is_banded(img, size, limit):
+        _, _, decoded_rows = _band_plan(img, size, limit)
+        # The decoded band plus Pillow's intermediate resampling buffer
+        return img.width * decoded_rows * per_pixel * 2 + output
+    scale = _draft_scale(img, size)
+    return math.ceil(img.width / scale) * math.ceil(img.height / scale) * per_pixel + output
+
+
+# ==================== CROP ====================
+
+def crop(source, box, limit=None):
+    """Crop `box` from the image in `source`, decoding as little of it as the format allows.
+
+    Striped/tiled images decode only the tiles under `box`; streamed formats
+    stop decoding at its bottom edge; anything else is decoded whole.
+    """
+    limit = memory_limit() if limit is None else limit
+    img = open_image(source)
+    check_memory(crop_bytes(img, box), limit)
+
+    strategy = _crop_strategy(img, box)
+    if strategy == 'full':
+        return img.crop(box)
+    if strategy == 'rows':
+        return _decode_rows(source, box[3]).crop(box)
+
+    region, union = _decode_tiles(source, box)
+    return region.crop((box[0] - union[0], box[1] - union[1], box[2] - union[0], box[3] - union[1]))
+
+
+# ==================== RESIZE ====================
+
+def _draft_scale(img, size):
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale straight from the DCT coefficients
+    if img.format != 'JPEG':
+        return 1
+    scale = 1
+    while scale < 8 and img.width / (scale * 2) >= size[0] and img.height / (scale * 2) >= size[1]:
+        scale *= 2
+    return scale
+
+
+def _is_banded(img, size, limit):
+    if not _is_tiled(img) or size[0] > img.width or size[1] > img.height:
+        return False
+    return _band_plan(img, size, limit) is not None
+
+
+def _band_plan(img, size, limit):
+    """Returns (output rows per band, source margin rows, decoded source rows per band).
+
+    Returns None when banding would not beat a single full decode: the filter
+    margin leaves no room in the band budget, or a band and its resampling
+    copy would hold as many rows as the whole image.
+    """
+    per_pixel = pixel_bytes(img.mode)
+    scale_y = img.height / size[1]
+    tile_rows = max(tile[1][3] - tile[1][1] for tile in img.tile)
+    # Extra source rows around each band so the filter sees its full support;
+    # band edges also snap outwards to whole tiles
+    margin = math.ceil(scale_y * 3) + 1
+    overhead = 2 * margin + 2 * tile_rows
+
+    # Whatever the output image leaves of the limit goes to the band and its resampling copy
+    available = min(
+        limit - size[0] * size[1] * per_pixel,
+        getattr(settings, 'IMAGE_BAND_MEMORY', 64 * MB),
+    )
+    rows = max(0, available) // (2 * img.width * per_pixel)
+    out_rows = min(size[1], int((rows - overhead) / scale_y)) if rows > overhead else 0
+    if out_rows < 1:
+        return None
+    decoded_rows = min(img.height, math.ceil(out_rows * scale_y) + overhead)
+    if 2 * decoded_rows >= img.height:
+        return None
+    return out_rows, margin, decoded_rows
+
+
+def resize(source, size, resample=Image.Resampling.LANCZOS, limit=None):
+    """Resize the image in `source` to `size`.
+
+    JPEGs are decoded at reduced scale where possible. Striped/tiled images
+    are downscaled band by band so only a slice of the source is ever decoded.
+    """
+    limit = memory_limit() if limit is None else limit
+    img = open_image(source)
+    check_memory(resize_bytes(img, size, limit), limit)
+
+    if not _is_banded(img, size, limit):
+        if _draft_scale(img, size) > 1:
+            img.draft(img.mode, size)
+        return img.resize(size, resample)
+
+    width, height = img.size
+    scale_y = height / size[1]
+    out_rows, margin, _ = _band_plan(img, size, limit)
+
+    output = Image.new(img.mode, size)
+    for out_top in range(0, size[1], out_rows):
+        out_bottom = min(size[1], out_top + out_rows)
+        src_top = out_top * scale_y
+        src_bottom = out_bottom * scale_y
+        band_box = (0, max(0, int(src_top) - margin), width, min(height, math.ceil(src_bottom) + margin))
+        band, union = _decode_tiles(source, band_box)
+        resized = band.resize(
+            (size[0], out_bottom - out_top), resample,
+            box=(0, src_top - union[1], width, src_bottom - union[1]),
+        )
+        output.paste(resized, (0, out_top))
+    if img.palette is not None and img.mode == 'P':
+        output.putpalette(img.getpalette())
+    return output
@@ -14,6 +14,7 @@ urlpatterns = [
     path('api/pdf/watermark/', views.watermark_pdf, name='watermark_pdf'),
     path('api/pdf/encrypt/', views.encrypt_pdf, name='encrypt_pdf'),
     path('api/pdf/compress/', views.compress_pdf, name='compress_pdf'),
+    path('api/pdf/pipeline/', views.pdf_pipeline, name='pdf_pipeline'),
     
     # Image operations
     path('api/image/resize-pixels/', views.resize_pixels, name='resize_pixels'),
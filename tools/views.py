@@ -1,14 +1,23 @@
 import os
 import io
-import zipfile
 from pathlib import Path
 from django.shortcuts import render, redirect
 from django.http import FileResponse, JsonResponse
 from django.core.files.storage import default_storage
+from django.utils.cache import patch_vary_headers
 from PIL import Image, ImageDraw
 import PyPDF2
 import pikepdf
 from pdf2image import convert_from_bytes
+from .admission import COMPRESS_PDF_DPIS, admitted_dpi
+from .archives import ArchiveWriter
+from .concurrency import offload
+from .encoders import (
+    FORMATS, LOSSY_FORMATS, available_formats, encode_image, get_preset,
+    image_response, negotiate_format, normalize_format, prepare_image, server_timing,
+)
+from .pipeline import Pipeline, PipelineError, parse_operations, rasterize_pdf, watermark_overlay
+from . import tiles
 try:
     import fitz  # PyMuPDF
 except ImportError:
@@ -29,6 +38,7 @@ def image_tools(request):
 
 # ==================== PDF OPERATIONS ====================
 
+@offload('merge_pdf', 'pdf.html')
 def merge_pdf(request):
     if request.method == 'POST' and request.FILES.getlist('pdfs'):
         try:
@@ -50,6 +60,7 @@ def merge_pdf(request):
     return redirect('pdf')
 
 
+@offload('delete_page', 'pdf.html')
 def delete_page(request):
     if request.method == 'POST' and request.FILES.get('pdf'):
         try:
@@ -74,17 +85,25 @@ def delete_page(request):
     return redirect('pdf')
 
 
+@offload('pdf_to_images', 'pdf.html')
 def pdf_to_images(request):
     if request.method == 'POST' and request.FILES.get('pdf'):
         try:
-            format_type = request.POST.get('format', 'png').lower()
+            fmt = negotiate_format(request, default='png')
+            if request.POST.get('format'):
+                fmt = normalize_format(request.POST['format'])
+            if fmt not in available_formats():
+                fmt = 'png'
+            preset = get_preset(request)
+            extension = FORMATS[fmt][2]
             pdf_file = request.FILES['pdf']
             pdf_bytes = pdf_file.read()
             
             # Try pdf2image first if poppler is available
             try:
                 from pdf2image import convert_from_bytes
-                images = convert_from_bytes(pdf_bytes, fmt=format_type, dpi=200)
+                # Pages are re-encoded below, so keep poppler's raw PPM output
+                images = convert_from_bytes(pdf_bytes, fmt='ppm', dpi=admitted_dpi(request, 200))
             except Exception as poppler_error:
                 # Fallback: Convert using PIL by rendering each page as image
                 # This is a workaround when poppler is not installed
@@ -112,29 +131,26 @@ def pdf_to_images(request):
                 return render(request, 'pdf.html', {'error': 'No images could be extracted from PDF'})
             
             # Create ZIP file with all images
-            output = io.BytesIO()
-            with zipfile.ZipFile(output, 'w') as zf:
+            encode_seconds = 0.0
+            with ArchiveWriter() as archive:
                 for i, img in enumerate(images):
-                    img_bytes = io.BytesIO()
-                    # Ensure proper format
-                    if format_type == 'jpg':
-                        if img.mode in ('RGBA', 'LA', 'P'):
-                            img = img.convert('RGB')
-                        img.save(img_bytes, format='JPEG', quality=95)
-                    else:
-                        img.save(img_bytes, format='PNG')
-                    img_bytes.seek(0)
-                    zf.writestr(f'page_{i+1}.{format_type}', img_bytes.getvalue())
+                    # Encode each page directly into its archive member
+                    with archive.open(f'page_{i+1}.{extension}') as member:
+                        _, elapsed = encode_image(img, fmt, preset, quality=95, output=member)
+                    encode_seconds += elapsed
+                output = archive.close()
             
-            output.seek(0)
             response = FileResponse(output, content_type='application/zip')
             response['Content-Disposition'] = 'attachment; filename="pdf_images.zip"'
+            response['Server-Timing'] = server_timing([('encode', encode_seconds)])
+            patch_vary_headers(response, ['Accept'])
             return response
         except Exception as e:
             return render(request, 'pdf.html', {'error': f'Error converting PDF to images: {str(e)}'})
     return redirect('pdf')
 
 
+@offload('images_to_pdf', 'pdf.html')
 def images_to_pdf(request):
     if request.method == 'POST' and request.FILES.getlist('images'):
         try:
@@ -156,6 +172,7 @@ def images_to_pdf(request):
     return redirect('pdf')
 
 
+@offload('watermark_pdf', 'pdf.html')
 def watermark_pdf(request):
     if request.method == 'POST' and request.FILES.get('pdf'):
         try:
@@ -187,9 +204,6 @@ def watermark_pdf(request):
 
             # Fallback: try reportlab to create a watermark and merge with PyPDF2
             try:
-                from reportlab.pdfgen import canvas
-                from reportlab.lib.colors import Color
-
                 pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
                 pdf_writer = PyPDF2.PdfWriter()
 
@@ -197,25 +211,7 @@ def watermark_pdf(request):
                     page_width = float(page.mediabox.width)
                     page_height = float(page.mediabox.height)
 
-                    watermark_buffer = io.BytesIO()
-                    c = canvas.Canvas(watermark_buffer, pagesize=(page_width, page_height))
-                    # Try setting alpha if available; ignore if not
-                    try:
-                        c.setFillAlpha(0.25)
-                    except Exception:
-                        pass
-
-                    c.saveState()
-                    c.translate(page_width / 2.0, page_height / 2.0)
-                    c.rotate(45)
-                    # Use a gray color
-                    c.setFillColor(Color(0.5, 0.5, 0.5))
-                    c.setFont("Helvetica", int(min(page_width, page_height) / 8))
-                    c.drawCentredString(0, 0, text)
-                    c.restoreState()
-                    c.save()
-
-                    watermark_buffer.seek(0)
+                    watermark_buffer = watermark_overlay(text, page_width, page_height)
                     watermark_pdf = PyPDF2.PdfReader(watermark_buffer)
                     watermark_page = watermark_pdf.pages[0]
                     try:
@@ -239,6 +235,7 @@ def watermark_pdf(request):
     return redirect('pdf')
 
 
+@offload('encrypt_pdf', 'pdf.html')
 def encrypt_pdf(request):
     if request.method == 'POST' and request.FILES.get('pdf'):
         try:
@@ -278,6 +275,7 @@ def encrypt_pdf(request):
     return redirect('pdf')
 
 
+@offload('compress_pdf', 'pdf.html')
 def compress_pdf(request):
     if request.method == 'POST' and request.FILES.get('pdf'):
         try:
@@ -296,65 +294,12 @@ def compress_pdf(request):
                 response['Content-Disposition'] = 'attachment; filename="compressed.pdf"'
                 return response
             
-            # Convert PDF to images and compress
-            from pdf2image import convert_from_bytes
-            
-            best_output = None
-            best_size = current_size
-            found_target = False
+            # Iteratively reduce DPI and quality until target is met,
+            # starting from the highest DPI admitted for this request
+            max_dpi = admitted_dpi(request, COMPRESS_PDF_DPIS[0])
+            best_output = rasterize_pdf(pdf_bytes, target_bytes, [d for d in COMPRESS_PDF_DPIS if d <= max_dpi])
             
-            # Iteratively reduce DPI and quality until target is met
-            for dpi in [300, 200, 150, 100, 75, 50, 40, 30]:
-                if found_target:
-                    break
-                    
-                try:
-                    images = convert_from_bytes(pdf_bytes, dpi=dpi)
-                    
-                    if not images:
-                        continue
-                    
-                    # Try different quality levels
-                    for quality in [95, 85, 75, 65, 55, 45, 35, 25, 15]:
-                        try:
-                            output = io.BytesIO()
-                            
-                            # Convert all images to RGB
-                            rgb_images = [img.convert('RGB') for img in images]
-                            
-                            # Save as PDF with specified quality
-                            rgb_images[0].save(
-                                output,
-                                format='PDF',
-                                save_all=True,
-                                append_images=rgb_images[1:] if len(rgb_images) > 1 else [],
-                                quality=quality,
-                                optimize=True,
-                                compress_level=9
-                            )
-                            
-                            output.seek(0, 2)  # Seek to end to get size
-                            output_size = output.tell()
-                            output.seek(0)  # Reset to beginning
-                            
-                            # If we found exact or very close match, return it
-                            if output_size <= target_bytes:
-                                response = FileResponse(output, content_type='application/pdf')
-                                response['Content-Disposition'] = 'attachment; filename="compressed.pdf"'
-                                return response
-                            
-                            # Keep track of best compression
-                            if output_size < best_size:
-                                best_output = output
-                                best_size = output_size
-                        except:
-                            continue
-                except:
-                    continue
-            
-            # If we have a best output, return it
             if best_output:
-                best_output.seek(0)
                 response = FileResponse(best_output, content_type='application/pdf')
                 response['Content-Disposition'] = 'attachment; filename="compressed.pdf"'
                 return response
@@ -369,29 +314,52 @@ def compress_pdf(request):
     return redirect('pdf')
 
 
+@offload('pdf_pipeline', 'pdf.html')
+def pdf_pipeline(request):
+    if request.method == 'POST' and request.FILES.getlist('pdfs'):
+        try:
+            steps = parse_operations(request.POST.get('operations'))
+            max_dpi = admitted_dpi(request, COMPRESS_PDF_DPIS[0])
+            
+            # All steps share one parsed document; it is serialized once at the end
+            pipeline = Pipeline(request.FILES.getlist('pdfs'), [d for d in COMPRESS_PDF_DPIS if d <= max_dpi])
+            try:
+                output = pipeline.run(steps)
+            finally:
+                pipeline.close()
+            
+            response = FileResponse(output, content_type='application/pdf')
+            response['Content-Disposition'] = 'attachment; filename="processed.pdf"'
+            response['Server-Timing'] = server_timing(pipeline.timings)
+            return response
+        except PipelineError as e:
+            return render(request, 'pdf.html', {'error': str(e)})
+        except Exception as e:
+            return render(request, 'pdf.html', {'error': f'Error running pipeline: {str(e)}'})
+    return redirect('pdf')
+
+
 # ==================== IMAGE OPERATIONS ====================
 
+@offload('resize_pixels', 'images.html')
 def resize_pixels(request):
     if request.method == 'POST' and request.FILES.get('image'):
         try:
             width = int(request.POST.get('width', 800))
             height = int(request.POST.get('height', 600))
             
-            img = Image.open(request.FILES['image'])
-            img = img.resize((width, height), Image.Resampling.LANCZOS)
+            fmt = negotiate_format(request, default='png')
             
-            output = io.BytesIO()
-            img.save(output, format='PNG')
-            output.seek(0)
+            img = tiles.resize(request.FILES['image'], (width, height), Image.Resampling.LANCZOS)
             
-            response = FileResponse(output, content_type='image/png')
-            response['Content-Disposition'] = 'attachment; filename="resized.png"'
-            return response
+            output, encode_seconds = encode_image(img, fmt, get_preset(request))
+            return image_response(output, fmt, 'resized', encode_seconds)
         except Exception as e:
             return render(request, 'images.html', {'error': f'Error resizing image: {str(e)}'})
     return redirect('images')
 
 
+@offload('resize_filesize', 'images.html')
 def resize_filesize(request):
     if request.method == 'POST' and request.FILES.get('image'):
         try:
@@ -401,35 +369,33 @@ def resize_filesize(request):
             # Convert target size to bytes
             target_bytes = size * 1024 if unit == 'kb' else size * 1024 * 1024
             
-            img = Image.open(request.FILES['image'])
+            # Only lossy formats can be driven towards a target size
+            fmt = negotiate_format(request, default='jpeg', allowed=LOSSY_FORMATS)
+            preset = get_preset(request)
+            
+            # Convert once up front rather than on every quality step
+            img = prepare_image(Image.open(request.FILES['image']), fmt)
             quality = 85
+            encode_seconds = 0.0
             
             # Iteratively reduce quality until target size is met
             while quality > 10:
-                output = io.BytesIO()
-                img.save(output, format='JPEG', quality=quality, optimize=True)
-                output.seek(0, 2)  # Seek to end
-                file_size = output.tell()
+                output, elapsed = encode_image(img, fmt, preset, quality=quality)
+                encode_seconds += elapsed
                 
-                if file_size <= target_bytes:
-                    output.seek(0)
-                    response = FileResponse(output, content_type='image/jpeg')
-                    response['Content-Disposition'] = 'attachment; filename="resized.jpg"'
-                    return response
+                if output.tell() <= target_bytes:
+                    return image_response(output, fmt, 'resized', encode_seconds)
                 
                 quality -= 5
             
-            output = io.BytesIO()
-            img.save(output, format='JPEG', quality=10, optimize=True)
-            output.seek(0)
-            response = FileResponse(output, content_type='image/jpeg')
-            response['Content-Disposition'] = 'attachment; filename="resized.jpg"'
-            return response
+            output, elapsed = encode_image(img, fmt, preset, quality=10)
+            return image_response(output, fmt, 'resized', encode_seconds + elapsed)
         except Exception as e:
             return render(request, 'images.html', {'error': f'Error resizing image: {str(e)}'})
     return redirect('images')
 
 
+@offload('crop_image', 'images.html')
 def crop_image(request):
     if request.method == 'POST':
         try:
@@ -445,54 +411,43 @@ def crop_image(request):
                 img_data = request.POST.get('image_data')
                 if img_data.startswith('data:image'):
                     img_data = img_data.split(',')[1]
-                img_bytes = base64.b64decode(img_data)
-                img = Image.open(io.BytesIO(img_bytes))
+                source = io.BytesIO(base64.b64decode(img_data))
             elif request.FILES.get('image'):
-                img = Image.open(request.FILES['image'])
+                source = request.FILES['image']
             else:
                 return render(request, 'images.html', {'error': 'No image provided'})
             
-            # Ensure crop coordinates are within bounds
-            left = max(0, min(left, img.width))
-            top = max(0, min(top, img.height))
-            right = max(left + 1, min(right, img.width))
-            bottom = max(top + 1, min(bottom, img.height))
-            
-            img = img.crop((left, top, right, bottom))
-            
-            output = io.BytesIO()
-            img.save(output, format='PNG')
-            output.seek(0)
+            # Only the header is read here; the crop decodes just the tiles it needs
+            img = tiles.open_image(source)
+            box = tiles.clamp_box((left, top, right, bottom), img.size)
+            img = tiles.crop(source, box)
             
-            response = FileResponse(output, content_type='image/png')
-            response['Content-Disposition'] = 'attachment; filename="cropped.png"'
-            return response
+            fmt = negotiate_format(request, default='png')
+            output, encode_seconds = encode_image(img, fmt, get_preset(request))
+            return image_response(output, fmt, 'cropped', encode_seconds)
         except Exception as e:
             return render(request, 'images.html', {'error': f'Error cropping image: {str(e)}'})
     return redirect('images')
 
 
+@offload('compress_image', 'images.html')
 def compress_image(request):
     if request.method == 'POST' and request.FILES.get('image'):
         try:
             quality = int(request.POST.get('quality', 75))
             
-            img = Image.open(request.FILES['image'])
-            if img.mode in ('RGBA', 'LA', 'P'):
-                img = img.convert('RGB')
+            fmt = negotiate_format(request, default='jpeg', allowed=LOSSY_FORMATS)
             
-            output = io.BytesIO()
-            img.save(output, format='JPEG', quality=quality, optimize=True)
-            output.seek(0)
+            img = Image.open(request.FILES['image'])
             
-            response = FileResponse(output, content_type='image/jpeg')
-            response['Content-Disposition'] = 'attachment; filename="compressed.jpg"'
-            return response
+            output, encode_seconds = encode_image(img, fmt, get_preset(request), quality=quality)
+            return image_response(output, fmt, 'compressed', encode_seconds)
         except Exception as e:
             return render(request, 'images.html', {'error': f'Error compressing image: {str(e)}'})
     return redirect('images')
 
 
+@offload('create_collage', 'images.html')
 def create_collage(request):
     if request.method == 'POST' and request.FILES.getlist('images'):
         try:
@@ -526,13 +481,9 @@ def create_collage(request):
                 y = row * (img_height + spacing)
                 collage.paste(img, (x, y))
             
-            output = io.BytesIO()
-            collage.save(output, format='PNG')
-            output.seek(0)
-            
-            response = FileResponse(output, content_type='image/png')
-            response['Content-Disposition'] = 'attachment; filename="collage.png"'
-            return response
+            fmt = negotiate_format(request, default='png')
+            output, encode_seconds = encode_image(collage, fmt, get_preset(request))
+            return image_response(output, fmt, 'collage', encode_seconds)
         except Exception as e:
             return render(request, 'images.html', {'error': f'Error creating collage: {str(e)}'})
     return redirect('images')